@@ -3,6 +3,7 @@ Anomaly Detection Module for Darwin Company
 Detects anomalies based on average behavior per account using percentage threshold from settings.
 """
 
+import logging
 import pandas as pd
 import numpy as np
 from datetime import datetime
@@ -11,6 +12,8 @@ from typing import Dict, Any, List, Tuple
 import warnings
 warnings.filterwarnings('ignore')
 
+logger = logging.getLogger(__name__)
+
 
 class AnomalyDetector:
     """Detects anomalies in accounting transactions based on average behavior."""
@@ -53,92 +56,109 @@ class AnomalyDetector:
                     raise ValueError(f"Setting '{setting_key}' not found in config.setting table")
                 
                 percentage = float(row[0])
-                print(f"✓ Percentage threshold loaded from settings: {percentage}%")
+                logger.info("✓ Percentage threshold loaded from settings: %s%%", percentage)
                 return percentage
                 
         except Exception as e:
-            print(f"❌ Error loading percentage threshold: {e}")
+            logger.error("❌ Error loading percentage threshold: %s", e)
             raise
     
-    def load_transaction_data(self) -> pd.DataFrame:
+    def detect_anomalies(self) -> pd.DataFrame:
         """
-        Load transaction data from the database view.
+        Detect anomalies server-side and load only the anomalous transactions.
+        
+        Per-account averages and the percentage deviation are computed in SQL
+        Server with window functions, so only rows at or above the threshold
+        are transferred.
         
         Returns:
-            DataFrame with transaction data
+            DataFrame with detected anomalies
         """
         lookback_days = self.anomaly_config.get('lookback_days', 365)
         
-        query = f"""
-        SELECT  
-            A.accountID,
-            A.accountNumber,
-            B.[description] AS account,
-            A.dtmDate,
-            ISNULL(A.curDebit,0) - ISNULL(A.curCredit,0) AS amount
-        FROM    rep_GLSource AS A WITH (NOLOCK) 
-        INNER JOIN glAccount AS B WITH(NOLOCK) ON A.accountID = B.accountID 
-        WHERE   dtmDate >= DATEADD(DAY, -{lookback_days}, GETDATE())
-        AND     ISNULL(A.curDebit,0) - ISNULL(A.curCredit,0) > 0
-        ORDER BY A.accountID, A.dtmDate
+        transactions_cte = """
+        WITH transactions AS (
+            SELECT  
+                A.accountID,
+                A.accountNumber,
+                B.[description] AS account,
+                A.dtmDate,
+                CAST(ISNULL(A.curDebit,0) - ISNULL(A.curCredit,0) AS FLOAT) AS amount
+            FROM    rep_GLSource AS A WITH (NOLOCK) 
+            INNER JOIN glAccount AS B WITH(NOLOCK) ON A.accountID = B.accountID 
+            WHERE   dtmDate >= DATEADD(DAY, -:lookback_days, GETDATE())
+            AND     ISNULL(A.curDebit,0) - ISNULL(A.curCredit,0) > 0
+        )
         """
+        query = text(transactions_cte + """,
+        scored AS (
+            SELECT  
+                T.*,
+                (T.amount - T.avg_amount) / NULLIF(T.avg_amount, 0) * 100 AS pct_diff_from_avg
+            FROM (
+                SELECT  
+                    *,
+                    AVG(amount) OVER (PARTITION BY accountID) AS avg_amount,
+                    COUNT(*) OVER () AS total_transactions
+                FROM    transactions
+            ) AS T
+        )
+        SELECT  
+            accountID,
+            accountNumber,
+            account,
+            dtmDate,
+            amount,
+            avg_amount,
+            pct_diff_from_avg,
+            total_transactions
+        FROM    scored
+        WHERE   pct_diff_from_avg >= :threshold
+        ORDER BY accountID, dtmDate
+        """)
+        # The total rides on the anomalous rows, so it is only counted
+        # separately when there are none, to tell a clean run from no data
+        count_query = text(transactions_cte + "SELECT COUNT(*) FROM transactions")
+        params = {"lookback_days": int(lookback_days), "threshold": self.percentage_threshold}
         
         try:
-            print(f"\n📊 Loading transaction data (last {lookback_days} days)...")
-            df = pd.read_sql(query, self.engine)
-            df['dtmDate'] = pd.to_datetime(df['dtmDate'])
-            
-            print(f"✓ Data loaded: {len(df):,} transactions")
-            print(f"  - Unique accounts: {df['accountID'].nunique()}")
-            print(f"  - Date range: {df['dtmDate'].min().date()} to {df['dtmDate'].max().date()}")
-            
-            return df
+            logger.info("\n🔍 Detecting anomalies (last %s days)...", lookback_days)
+            anomalies = pd.read_sql(query, self.engine, params=params, parse_dates=['dtmDate'])
+            if len(anomalies):
+                total_transactions = int(anomalies['total_transactions'].iat[0])
+            else:
+                with self.engine.connect() as conn:
+                    total_transactions = conn.execute(
+                        count_query, {"lookback_days": params["lookback_days"]}
+                    ).scalar()
+            # IDs fit in a narrower integer; amounts stay float64, which keeps cent-level
+            # precision for GL-sized amounts (float32 does not)
+            anomalies['accountID'] = pd.to_numeric(anomalies['accountID'], downcast='integer')
             
         except Exception as e:
-            print(f"❌ Error loading transaction data: {e}")
+            logger.error("❌ Error detecting anomalies: %s", e)
             raise
-    
-    def calculate_averages_and_detect(self, df: pd.DataFrame) -> pd.DataFrame:
-        """
-        Calculate average per account and detect anomalies.
         
-        Args:
-            df: DataFrame with transaction data
-            
-        Returns:
-            DataFrame with detected anomalies
-        """
-        print(f"\n🔍 Calculating averages and detecting anomalies...")
+        anomalies = anomalies.drop(columns='total_transactions')
         
-        # Calculate average amount per account
-        account_averages = df.groupby('accountID')['amount'].agg([
-            ('avg_amount', 'mean'),
-            ('std_amount', 'std'),
-            ('min_amount', 'min'),
-            ('max_amount', 'max'),
-            ('count_transactions', 'count')
-        ]).reset_index()
+        if total_transactions == 0:
+            logger.warning("⚠️  No transaction data found")
+            return anomalies
         
-        # Merge averages back to original data
-        df = df.merge(account_averages, on='accountID', how='left')
-        
-        # Calculate percentage difference from average
-        df['pct_diff_from_avg'] = ((df['amount'] - df['avg_amount']) / df['avg_amount']) * 100
-        
-        # Detect anomalies: transactions that exceed the threshold percentage
-        df['is_anomaly'] = df['pct_diff_from_avg'] >= self.percentage_threshold
-        
-        # Filter only anomalies
-        anomalies = df[df['is_anomaly']].copy()
+        logger.info("✓ Data loaded: %s transactions", f"{total_transactions:,}")
         
         # Add detection metadata
         anomalies['detection_date'] = datetime.now()
         anomalies['threshold_used'] = self.percentage_threshold
         anomalies['company'] = self.company_name
         
-        print(f"✓ Anomalies detected: {len(anomalies):,} out of {len(df):,} transactions")
-        print(f"  - Threshold used: {self.percentage_threshold}%")
-        print(f"  - Anomaly rate: {(len(anomalies)/len(df)*100):.2f}%")
+        if len(anomalies):
+            logger.info("✓ Anomalies detected: %s out of %s transactions",
+                        f"{len(anomalies):,}", f"{total_transactions:,}")
+            logger.info("  - Threshold used: %s%%", self.percentage_threshold)
+            logger.info("  - Anomaly rate: %.2f%%", len(anomalies) / total_transactions * 100)
+        else:
+            logger.info("✓ No anomalies detected (threshold used: %s%%)", self.percentage_threshold)
         
         return anomalies
     
@@ -153,7 +173,7 @@ class AnomalyDetector:
             Number of records saved
         """
         if len(anomalies) == 0:
-            print("\n✓ No anomalies to save")
+            logger.info("\n✓ No anomalies to save")
             return 0
         
         table_name = self.anomaly_config['anomaly_table']
@@ -165,25 +185,28 @@ class AnomalyDetector:
             'detection_date', 'company'
         ]
         
-        anomalies_to_save = anomalies[save_columns].copy()
+        # Column selection already yields a new frame; it is only read from here
+        anomalies_to_save = anomalies[save_columns]
         
         try:
-            print(f"\n💾 Saving {len(anomalies_to_save)} anomalies to table '{table_name}'...")
+            logger.info("\n💾 Saving %d anomalies to table '%s'...", len(anomalies_to_save), table_name)
             
+            # Plain executemany: with the engine's fast_executemany each chunk is
+            # sent as one parameter array (multi-row VALUES would also exceed
+            # SQL Server's 2100 parameter limit at this chunk size)
             anomalies_to_save.to_sql(
                 name=table_name,
                 con=self.engine,
                 if_exists='append',
                 index=False,
-                method='multi',
-                chunksize=1000
+                chunksize=10000
             )
             
-            print(f"✓ Successfully saved {len(anomalies_to_save)} records to {table_name}")
+            logger.info("✓ Successfully saved %d records to %s", len(anomalies_to_save), table_name)
             return len(anomalies_to_save)
             
         except Exception as e:
-            print(f"❌ Error saving anomalies to database: {e}")
+            logger.error("❌ Error saving anomalies to database: %s", e)
             raise
     
     def run_detection(self) -> Tuple[pd.DataFrame, int]:
@@ -196,15 +219,8 @@ class AnomalyDetector:
         # Get threshold from settings
         self.percentage_threshold = self.get_percentage_threshold()
         
-        # Load transaction data
-        df = self.load_transaction_data()
-        
-        if len(df) == 0:
-            print("⚠️  No transaction data found")
-            return pd.DataFrame(), 0
-        
         # Detect anomalies
-        anomalies = self.calculate_averages_and_detect(df)
+        anomalies = self.detect_anomalies()
         
         # Save to database
         records_saved = self.save_anomalies_to_database(anomalies)
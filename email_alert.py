@@ -3,55 +3,25 @@ Email Alert System for Darwin Company
 Sends detailed email alerts about detected anomalies.
 """
 
+import logging
+import re
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
+from html import escape
 import pandas as pd
 from datetime import datetime
 from typing import Dict, Any, List
 import io
 
+logger = logging.getLogger(__name__)
 
-class EmailAlertSystem:
-    """Handles email alerts for detected anomalies."""
-    
-    def __init__(self, config: Dict[str, Any]):
-        """
-        Initialize the email alert system.
-        
-        Args:
-            config: Configuration dictionary
-        """
-        self.config = config
-        self.email_config = config['email']
-        self.company_name = config['company']['name']
-        self.enabled = self.email_config.get('enabled', True)
-        
-    def create_email_body(self, anomalies: pd.DataFrame, threshold: float) -> str:
-        """
-        Create detailed email body with anomaly information.
-        
-        Args:
-            anomalies: DataFrame with detected anomalies
-            threshold: Percentage threshold used for detection
-            
-        Returns:
-            HTML formatted email body
-        """
-        total_anomalies = len(anomalies)
-        total_amount = anomalies['amount'].sum()
-        avg_deviation = anomalies['pct_diff_from_avg'].mean()
-        
-        # Group by account for summary
-        account_summary = anomalies.groupby(['accountNumber', 'account']).agg({
-            'amount': ['count', 'sum', 'mean'],
-            'pct_diff_from_avg': 'mean'
-        }).round(2)
-        
-        # Create HTML email
-        html = f"""
+# Email body templates, parsed once at import. Placeholders are filled with
+# str.format, so literal CSS braces are doubled.
+_EMAIL_HEADER_TEMPLATE = """
         <html>
         <head>
             <style>
@@ -72,14 +42,14 @@ class EmailAlertSystem:
         </head>
         <body>
             <div class="header">
-                <h1><span class="alert-icon">🚨</span> {self.company_name} - Anomaly Detection Alert</h1>
+                <h1><span class="alert-icon">🚨</span> {company_name} - Anomaly Detection Alert</h1>
                 <p>Automated Anomaly Detection System</p>
             </div>
             
             <div class="content">
                 <h2>Anomaly Detection Report</h2>
                 <p>Dear Finance Team,</p>
-                <p>The {self.company_name} anomaly detection system has identified <span class="number">{total_anomalies}</span> 
+                <p>The {company_name} anomaly detection system has identified <span class="number">{total_anomalies}</span> 
                 transactions that exceed the configured threshold of <span class="number">{threshold}%</span> deviation from their account averages.</p>
                 
                 <div class="summary">
@@ -94,7 +64,7 @@ class EmailAlertSystem:
                         <span class="summary-label">Average Deviation:</span> {avg_deviation:.2f}%
                     </div>
                     <div class="summary-item">
-                        <span class="summary-label">Detection Date:</span> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+                        <span class="summary-label">Detection Date:</span> {detection_date}
                     </div>
                     <div class="summary-item">
                         <span class="summary-label">Threshold Used:</span> {threshold}%
@@ -117,31 +87,29 @@ class EmailAlertSystem:
                     </thead>
                     <tbody>
         """
-        
-        # Add rows for each anomaly (limit to top 50 for email readability)
-        display_limit = min(50, len(anomalies))
-        for idx, row in anomalies.head(display_limit).iterrows():
-            html += f"""
+
+# One <tr> of the detailed anomaly table: account number, account name,
+# date, amount, account average, % deviation
+_ANOMALY_ROW_TEMPLATE = """
                         <tr>
-                            <td>{row['accountNumber']}</td>
-                            <td>{row['account']}</td>
-                            <td>{row['dtmDate'].strftime('%Y-%m-%d')}</td>
-                            <td>${row['amount']:,.2f}</td>
-                            <td>${row['avg_amount']:,.2f}</td>
-                            <td style="color: #d32f2f; font-weight: bold;">{row['pct_diff_from_avg']:.2f}%</td>
+                            <td>{0}</td>
+                            <td>{1}</td>
+                            <td>{2}</td>
+                            <td>${3:,.2f}</td>
+                            <td>${4:,.2f}</td>
+                            <td style="color: #d32f2f; font-weight: bold;">{5:.2f}%</td>
                         </tr>
             """
-        
-        if len(anomalies) > display_limit:
-            html += f"""
+
+_MORE_ANOMALIES_ROW_TEMPLATE = """
                         <tr>
                             <td colspan="6" style="text-align: center; font-style: italic; color: #666;">
-                                ... and {len(anomalies) - display_limit} more anomalies (see attached CSV for complete list)
+                                ... and {0} more anomalies (see attached CSV for complete list)
                             </td>
                         </tr>
             """
-        
-        html += """
+
+_EMAIL_FOOTER_TEMPLATE = """
                     </tbody>
                 </table>
                 
@@ -158,14 +126,186 @@ class EmailAlertSystem:
             </div>
             
             <div class="footer">
-                <p>This is an automated message from the {self.company_name} Anomaly Detection System.</p>
-                <p>Generated on {datetime.now().strftime('%Y-%m-%d at %H:%M:%S')}</p>
+                <p>This is an automated message from the {company_name} Anomaly Detection System.</p>
+                <p>Generated on {generated_at}</p>
             </div>
         </body>
         </html>
         """
+
+
+# Any line ending (CRLF, bare LF or bare CR), rewritten to CRLF
+_BARE_EOL_RE = re.compile(r'\r\n|\n|\r(?!\n)')
+
+
+class PipeliningSMTP(smtplib.SMTP):
+    """
+    SMTP client that pipelines the message envelope (RFC 2920).
+    
+    When the server advertises PIPELINING, MAIL FROM and every RCPT TO are
+    written in a single packet and their replies read afterwards, so the
+    envelope costs one round-trip regardless of the number of recipients.
+    Servers without the extension get the stock smtplib behavior, and so
+    does any envelope with a refused or unexpected reply (after RSET).
+    
+    The pipelined path mirrors smtplib.SMTP.sendmail as of CPython 3.11
+    using only public methods; re-check it against that method when
+    upgrading Python.
+    """
+    
+    def _reset(self):
+        """Send RSET, ignoring a server that has already hung up."""
+        try:
+            self.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+    
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        if not (self.does_esmtp and self.has_extn('pipelining')):
+            return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        
+        if isinstance(msg, str):
+            msg = _BARE_EOL_RE.sub(smtplib.CRLF, msg).encode('ascii')
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        
+        esmtp_opts = list(mail_options)
+        if self.has_extn('size'):
+            esmtp_opts.insert(0, "size=%d" % len(msg))
+        if any(opt.lower() == 'smtputf8' for opt in esmtp_opts):
+            if not self.has_extn('smtputf8'):
+                raise smtplib.SMTPNotSupportedError('SMTPUTF8 not supported by server')
+            self.command_encoding = 'utf-8'
+        mail_suffix = ''.join(' ' + opt for opt in esmtp_opts)
+        rcpt_suffix = ''.join(' ' + opt for opt in rcpt_options)
+        
+        # Write the whole envelope, then collect the replies in order
+        commands = [f"mail FROM:{smtplib.quoteaddr(from_addr)}{mail_suffix}{smtplib.CRLF}"]
+        commands += [f"rcpt TO:{smtplib.quoteaddr(rcpt)}{rcpt_suffix}{smtplib.CRLF}" for rcpt in to_addrs]
+        self.send(''.join(commands))
+        
+        code, resp = self.getreply()
+        if code == 421:
+            self.close()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        
+        rcpt_codes = []
+        for rcpt in to_addrs:
+            rcpt_code, rcpt_resp = self.getreply()
+            if rcpt_code == 421:
+                self.close()
+                raise smtplib.SMTPRecipientsRefused({rcpt: (rcpt_code, rcpt_resp)})
+            rcpt_codes.append(rcpt_code)
+        
+        if code != 250 or any(c not in (250, 251) for c in rcpt_codes):
+            # Refused or out-of-sequence reply: redo the envelope one command
+            # at a time so errors are reported exactly as stock smtplib does
+            self._reset()
+            return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        
+        code, resp = self.data(msg)
+        if code != 250:
+            if code == 421:
+                self.close()
+            else:
+                self._reset()
+            raise smtplib.SMTPDataError(code, resp)
+        # Every recipient was accepted on this path
+        return {}
+
+
+class EmailAlertSystem:
+    """Handles email alerts for detected anomalies."""
+    
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Initialize the email alert system.
+        
+        Args:
+            config: Configuration dictionary
+        """
+        self.config = config
+        self.email_config = config['email']
+        self.company_name = config['company']['name']
+        self._company_name_html = escape(self.company_name)
+        self.enabled = self.email_config.get('enabled', True)
+        self.max_sends_per_connection = self.email_config.get('max_sends_per_connection', 100)
         
-        return html
+        # SMTP settings, resolved once instead of on every connection
+        self.smtp_server = self.email_config.get('smtp_server', 'localhost')
+        self.smtp_port = self.email_config.get('smtp_port', 25)
+        self.smtp_timeout = self.email_config.get('smtp_timeout', 10)
+        self.smtp_pipelining = self.email_config.get('smtp_pipelining', False)
+        self.use_tls = self.email_config.get('use_tls', False)
+        self.use_auth = self.email_config.get('use_authentication', False)
+        self.smtp_username = self.email_config.get('smtp_username', '')
+        self.smtp_password = self.email_config.get('smtp_password', '')
+        
+        # Envelope headers are the same for every alert
+        self.recipients = list(self.email_config.get('recipients', []))
+        from_name = self.email_config.get('from_name', '')
+        from_email = self.email_config.get('from_email', '')
+        self._from_header = f"{from_name} <{from_email}>" if from_name else from_email
+        self._to_header = ", ".join(self.recipients)
+        self._subject_template = (
+            f"🚨 {self.company_name.replace('%', '%%')} - %d Anomalies Detected - Action Required"
+        )
+        
+        # SMTP connection reused across alerts (see _get_smtp)
+        self._smtp = None
+        self._smtp_send_count = 0
+        self._smtp_lock = threading.Lock()
+        
+    def create_email_body(self, anomalies: pd.DataFrame, threshold: float) -> str:
+        """
+        Create detailed email body with anomaly information.
+        
+        Args:
+            anomalies: DataFrame with detected anomalies
+            threshold: Percentage threshold used for detection
+            
+        Returns:
+            HTML formatted email body
+        """
+        total_anomalies = len(anomalies)
+        total_amount = anomalies['amount'].sum()
+        avg_deviation = anomalies['pct_diff_from_avg'].mean()
+        
+        now = datetime.now()
+        parts = [_EMAIL_HEADER_TEMPLATE.format(
+            company_name=self._company_name_html,
+            total_anomalies=total_anomalies,
+            threshold=threshold,
+            total_amount=total_amount,
+            avg_deviation=avg_deviation,
+            detection_date=now.strftime('%Y-%m-%d %H:%M:%S'),
+        )]
+        
+        # Add rows for each anomaly (limit to top 50 for email readability)
+        display_limit = min(50, len(anomalies))
+        top = anomalies.head(display_limit)
+        parts.extend(
+            _ANOMALY_ROW_TEMPLATE.format(escape(str(number)), escape(str(name)), *values)
+            for number, name, *values in zip(
+                top['accountNumber'],
+                top['account'],
+                top['dtmDate'].dt.strftime('%Y-%m-%d'),
+                top['amount'],
+                top['avg_amount'],
+                top['pct_diff_from_avg'],
+            )
+        )
+        
+        if len(anomalies) > display_limit:
+            parts.append(_MORE_ANOMALIES_ROW_TEMPLATE.format(len(anomalies) - display_limit))
+        
+        parts.append(_EMAIL_FOOTER_TEMPLATE.format(
+            company_name=self._company_name_html,
+            generated_at=now.strftime('%Y-%m-%d at %H:%M:%S'),
+        ))
+        
+        return "".join(parts)
     
     def create_csv_attachment(self, anomalies: pd.DataFrame) -> bytes:
         """
@@ -183,9 +323,10 @@ class EmailAlertSystem:
             'avg_amount', 'pct_diff_from_avg', 'threshold_used', 'detection_date'
         ]
         
-        csv_buffer = io.StringIO()
-        anomalies[export_columns].to_csv(csv_buffer, index=False)
-        return csv_buffer.getvalue().encode('utf-8')
+        # Write encoded bytes straight into the buffer (no intermediate str copy)
+        csv_buffer = io.BytesIO()
+        anomalies[export_columns].to_csv(csv_buffer, index=False, encoding='utf-8')
+        return csv_buffer.getvalue()
     
     def send_alert(self, anomalies: pd.DataFrame, threshold: float) -> bool:
         """
@@ -199,26 +340,26 @@ class EmailAlertSystem:
             True if email sent successfully, False otherwise
         """
         if not self.enabled:
-            print("📧 Email alerts are disabled in configuration")
+            logger.info("📧 Email alerts are disabled in configuration")
             return False
         
         if len(anomalies) == 0:
-            print("📧 No anomalies to report via email")
+            logger.info("📧 No anomalies to report via email")
             return False
         
-        recipients = self.email_config.get('recipients', [])
+        recipients = self.recipients
         if not recipients:
-            print("⚠️  No email recipients configured")
+            logger.warning("⚠️  No email recipients configured")
             return False
         
         try:
-            print(f"\n📧 Preparing email alert for {len(recipients)} recipient(s)...")
+            logger.info("\n📧 Preparing email alert for %d recipient(s)...", len(recipients))
             
             # Create email message
             msg = MIMEMultipart('alternative')
-            msg['From'] = f"{self.email_config['from_name']} <{self.email_config['from_email']}>"
-            msg['To'] = ", ".join(recipients)
-            msg['Subject'] = f"🚨 {self.company_name} - {len(anomalies)} Anomalies Detected - Action Required"
+            msg['From'] = self._from_header
+            msg['To'] = self._to_header
+            msg['Subject'] = self._subject_template % len(anomalies)
             
             # Create email body
             html_body = self.create_email_body(anomalies, threshold)
@@ -236,34 +377,93 @@ class EmailAlertSystem:
             # Send email
             self._send_smtp(msg, recipients)
             
-            print(f"✓ Email alert sent successfully to {len(recipients)} recipient(s)")
+            logger.info("✓ Email alert sent successfully to %d recipient(s)", len(recipients))
             return True
             
         except Exception as e:
-            print(f"❌ Error sending email alert: {e}")
+            logger.error("❌ Error sending email alert: %s", e)
             return False
     
-    def _send_smtp(self, msg: MIMEMultipart, recipients: List[str]):
-        """Send email via SMTP."""
-        smtp_server = self.email_config['smtp_server']
-        smtp_port = self.email_config['smtp_port']
-        use_tls = self.email_config.get('use_tls', False)
-        use_auth = self.email_config.get('use_authentication', False)
+    def _get_smtp(self) -> smtplib.SMTP:
+        """
+        Return a live SMTP connection, reconnecting when needed.
+        
+        The cached connection is health-checked with NOOP and recycled after
+        max_sends_per_connection messages. Must be called with _smtp_lock held.
+        """
+        if self._smtp is not None:
+            if self._smtp_send_count >= self.max_sends_per_connection:
+                self._close_smtp()
+            else:
+                try:
+                    code, _ = self._smtp.noop()
+                    if code != 250:
+                        self._close_smtp()
+                except OSError:
+                    # Covers SMTPException too; the socket may still be open
+                    self._close_smtp()
+        
+        if self._smtp is None:
+            self._smtp = self._connect_smtp()
+            self._smtp_send_count = 0
         
-        server = smtplib.SMTP(smtp_server, smtp_port)
+        return self._smtp
+    
+    def _connect_smtp(self) -> smtplib.SMTP:
+        """Open a new SMTP connection with TLS/authentication per settings."""
+        smtp_class = PipeliningSMTP if self.smtp_pipelining else smtplib.SMTP
+        # The timeout also covers the TLS-wrapped socket after STARTTLS
+        server = smtp_class(self.smtp_server, self.smtp_port, timeout=self.smtp_timeout)
         
         try:
-            if use_tls:
+            if self.use_tls:
                 server.starttls()
             
-            if use_auth:
-                username = self.email_config.get('smtp_username', '')
-                password = self.email_config.get('smtp_password', '')
-                if username and password:
-                    server.login(username, password)
-            
-            server.send_message(msg)
-            
+            if self.use_auth and self.smtp_username and self.smtp_password:
+                server.login(self.smtp_username, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        
+        return server
+    
+    def _close_smtp(self):
+        """Quit the cached SMTP connection, ignoring errors on a dead socket."""
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
         finally:
-            server.quit()
-
+            self._smtp = None
+    
+    def close(self):
+        """Close the cached SMTP connection."""
+        with self._smtp_lock:
+            self._close_smtp()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _send_smtp(self, msg: MIMEMultipart, recipients: List[str]):
+        """Send email via SMTP, reusing the cached connection."""
+        with self._smtp_lock:
+            server = self._get_smtp()
+            try:
+                server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._close_smtp()
+                raise
+            except smtplib.SMTPException:
+                # Refused sender/recipients/data: smtplib already sent RSET and
+                # the session stays usable, so keep the connection
+                raise
+            except OSError:
+                # Transport failure; close it so the next send reconnects
+                self._close_smtp()
+                raise
+            self._smtp_send_count += 1
@@ -10,6 +10,7 @@ This system:
 """
 
 import json
+import logging
 import sys
 from datetime import datetime
 from sqlalchemy import create_engine
@@ -70,17 +71,17 @@ class AnomalyDetectionSystem:
                     f"?driver={db_config['driver'].replace(' ', '+')}"
                 )
             
-            engine = create_engine(connection_string)
+            # fast_executemany sends bulk inserts as a single parameter array.
+            # Connections are opened lazily: the first query (loading the
+            # threshold setting) checks one out, and pool_pre_ping validates it
+            # and transparently replaces connections dropped by the server.
+            engine = create_engine(connection_string, fast_executemany=True, pool_pre_ping=True)
             
-            # Test connection
-            with engine.connect() as conn:
-                conn.execute("SELECT 1")
-            
-            print(f"✓ Database connection established: {db_config['server']}/{db_config['database']}")
+            print(f"✓ Database engine configured: {db_config['server']}/{db_config['database']}")
             return engine
             
         except Exception as e:
-            print(f"❌ Error connecting to database: {e}")
+            print(f"❌ Error configuring database engine: {e}")
             sys.exit(1)
     
     def run(self):
@@ -104,11 +105,11 @@ class AnomalyDetectionSystem:
             if len(anomalies) > 0:
                 print("\nSTEP 2: Sending Email Alerts")
                 print("-" * 80)
-                email_system = EmailAlertSystem(self.config)
-                email_sent = email_system.send_alert(
-                    anomalies, 
-                    detector.percentage_threshold
-                )
+                with EmailAlertSystem(self.config) as email_system:
+                    email_sent = email_system.send_alert(
+                        anomalies, 
+                        detector.percentage_threshold
+                    )
                 
                 if email_sent:
                     print("✓ Email alert process completed")
@@ -148,6 +149,9 @@ class AnomalyDetectionSystem:
 
 def main():
     """Main entry point."""
+    # Module status lines go through logging; keep them on stdout, unadorned,
+    # so they interleave with the banners printed here.
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
     system = AnomalyDetectionSystem()
     system.run()
 
@@ -2,103 +2,191 @@
 Script para probar la conexión a la base de datos SQL Server en Docker
 """
 
+import functools
 import json
+import os
+import socket
 from sqlalchemy import create_engine, text
 from urllib.parse import quote_plus
 
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
 
-def test_database_connection():
-    """Prueba la conexión a la base de datos."""
+# Separadores de la salida
+_BAR = "=" * 80
+_RULE = "-" * 80
 
-    # Cargar configuración
-    print("📋 Cargando configuración desde config.json...")
-    with open('config.json', 'r', encoding='utf-8') as f:
+# Vista que consume el detector de anomalías; las consultas y mensajes de
+# abajo se construyen a partir de este nombre. Sin esquema, igual que en
+# create_view.sql, para que se resuelva en el esquema por defecto del usuario
+_VIEW_NAME = "vw_GLSource_daily"
+
+# Consultas compiladas una sola vez; con parámetros enlazados el texto no
+# cambia entre llamadas y SQL Server reutiliza el plan en caché.
+# Versión, base de datos, existencia de la vista y su conteo en un solo lote:
+# por la resolución diferida de nombres, el COUNT sobre la vista solo falla
+# si llega a ejecutarse, y el IF lo evita cuando no existe.
+_Q_SERVER_INFO = text(f"""
+    SET NOCOUNT ON;
+    DECLARE @exists_view bit = CASE WHEN OBJECT_ID(:view_name, 'V') IS NULL THEN 0 ELSE 1 END;
+    DECLARE @total_records bigint = NULL;
+    IF @exists_view = 1
+        SELECT @total_records = COUNT_BIG(*) FROM {_VIEW_NAME};
+    SELECT 
+        CONVERT(nvarchar(64), SERVERPROPERTY('ProductVersion')) AS product_version,
+        CONVERT(nvarchar(64), SERVERPROPERTY('Edition')) AS edition,
+        DB_NAME() AS current_db,
+        @exists_view AS exists_view,
+        @total_records AS total_records;
+""")
+_Q_SAMPLE = text(f"""
+    SELECT TOP 5 
+        accountID,
+        accountNumber,
+        account,
+        dtmDate,
+        amount
+    FROM {_VIEW_NAME} 
+    ORDER BY dtmDate DESC
+""")
+
+# Configuración ya parseada por ruta: {ruta: (mtime_ns, tamaño, config)}
+_CONFIG_CACHE = {}
+
+
+def _load_config(path='config.json'):
+    """Carga la configuración, reutilizándola mientras el archivo no cambie."""
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    cached = _CONFIG_CACHE.get(abs_path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(abs_path, 'r', encoding='utf-8') as f:
         config = json.load(f)
+    _CONFIG_CACHE[abs_path] = (stat.st_mtime_ns, stat.st_size, config)
+    return config
 
-    db_config = config['database']
 
-    # Mostrar configuración (sin mostrar la contraseña completa)
-    print("\n🔧 Configuración de conexión:")
-    print(f"  - Servidor: {db_config['server']}")
-    print(f"  - Puerto: {db_config.get('port', 'default')}")
-    print(f"  - Base de datos: {db_config['database']}")
-    print(f"  - Usuario: {db_config.get('username', 'N/A')}")
-    print(f"  - Contraseña: {'*' * len(db_config.get('password', ''))}")
+@functools.lru_cache(maxsize=4)
+def _build_connection_string(server, port, username, password, database, driver=None):
+    """
+    Construye (una vez por configuración) la URL de conexión.
+    
+    Usa el driver ODBC de Microsoft si pyodbc está instalado y el driver
+    configurado está disponible; si no, usa pymssql (no requiere drivers ODBC).
+    """
+    if pyodbc is not None and driver and driver in pyodbc.drivers():
+        return (
+            f"mssql+pyodbc://{username}:{quote_plus(password)}@{server}:{port}/{database}"
+            f"?driver={quote_plus(driver)}"
+        )
+    return f"mssql+pymssql://{username}:{quote_plus(password)}@{server}:{port}/{database}"
+
+
+@functools.lru_cache(maxsize=4)
+def _get_engine(connection_string):
+    """Devuelve un engine con pool de conexiones, reutilizado entre llamadas."""
+    # Solo se ejecutan consultas de lectura: AUTOCOMMIT evita el BEGIN/COMMIT implícito
+    return create_engine(
+        connection_string,
+        isolation_level="AUTOCOMMIT",
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
 
-    # Construir connection string usando pymssql (no requiere drivers ODBC)
+
+def test_database_connection(verbose: bool = False):
+    """
+    Prueba la conexión a la base de datos.
+    
+    Args:
+        verbose: Si es True, muestra además los 5 registros más recientes de la
+            vista (consulta ordenada por dtmDate, se omite en chequeos rápidos)
+    """
+
+    # Cargar configuración
+    print("📋 Cargando configuración desde config.json...")
+    config = _load_config()
+
+    # Leer los parámetros de conexión una sola vez
+    db_config = config['database']
     server = db_config['server']
     port = db_config.get('port', 1433)
     username = db_config.get('username', '')
     password = db_config.get('password', '')
     database = db_config['database']
+    driver = db_config.get('driver')
+    probe_timeout = db_config.get('probe_timeout', 0.5)
 
-    # Usar pymssql en lugar de pyodbc para evitar problemas con drivers ODBC
-    connection_string = f"mssql+pymssql://{username}:{quote_plus(password)}@{server}:{port}/{database}"
+    # Mostrar configuración (sin mostrar la contraseña completa)
+    print("\n🔧 Configuración de conexión:")
+    print(f"  - Servidor: {server}")
+    print(f"  - Puerto: {port}")
+    print(f"  - Base de datos: {database}")
+    print(f"  - Usuario: {username or 'N/A'}")
+    print(f"  - Contraseña: {'***' if password else '(vacía)'}")
+
+    connection_string = _build_connection_string(server, port, username, password, database, driver)
+    dialect = connection_string.split('://', 1)[0]
 
-    print(f"\n🔗 Connection string: mssql+pymssql://***:***@{server}:{port}/{database}")
+    print(f"\n🔗 Connection string: {dialect}://***:***@{server}:{port}/{database}")
     
     # Intentar conectar
     print("\n🔌 Intentando conectar a la base de datos...")
     try:
-        engine = create_engine(connection_string)
+        # Comprobación TCP rápida: si el puerto rechaza la conexión no vale la
+        # pena crear el engine ni esperar el timeout de login del driver
+        try:
+            socket.create_connection((server, int(port)), timeout=probe_timeout).close()
+        except (socket.timeout, socket.gaierror) as e:
+            # Enlace lento o nombre que solo resuelve el driver (p. ej. HOST\INSTANCE)
+            print(f"⚠️  Comprobación TCP no concluyente ({e}); se intenta conectar igualmente")
+        
+        engine = _get_engine(connection_string)
         
         # Probar la conexión ejecutando una query simple
         with engine.connect() as connection:
             print("✅ ¡Conexión exitosa!")
             
-            # Obtener versión de SQL Server
-            result = connection.execute(text("SELECT @@VERSION AS version"))
-            version = result.fetchone()[0]
+            # Versión, base de datos actual, existencia y conteo de la vista en un solo viaje
+            result = connection.execute(_Q_SERVER_INFO, {"view_name": _VIEW_NAME})
+            product_version, edition, current_db, view_exists, total_records = result.fetchone()
+            
             print(f"\n📊 Versión de SQL Server:")
-            print(f"  {version.split('\\n')[0]}")
+            print(f"  {product_version} ({edition})")
             
-            # Obtener nombre de la base de datos actual
-            result = connection.execute(text("SELECT DB_NAME() AS current_db"))
-            current_db = result.fetchone()[0]
             print(f"\n💾 Base de datos actual: {current_db}")
             
-            # Verificar si existe la vista vw_GLSource_daily
-            print("\n🔍 Verificando vista vw_GLSource_daily...")
-            result = connection.execute(text("""
-                SELECT COUNT(*) as exists_view
-                FROM INFORMATION_SCHEMA.VIEWS 
-                WHERE TABLE_NAME = 'vw_GLSource_daily'
-            """))
-            view_exists = result.fetchone()[0]
+            # Verificar si existe la vista
+            print(f"\n🔍 Verificando vista {_VIEW_NAME}...")
             
             if view_exists:
-                print("✅ La vista vw_GLSource_daily existe")
-                
-                # Contar registros en la vista
-                result = connection.execute(text("SELECT COUNT(*) as total FROM vw_GLSource_daily"))
-                total_records = result.fetchone()[0]
+                print(f"✅ La vista {_VIEW_NAME} existe")
                 print(f"  - Total de registros: {total_records:,}")
                 
-                if total_records > 0:
+                if verbose and total_records > 0:
                     # Mostrar algunos registros de ejemplo
-                    result = connection.execute(text("""
-                        SELECT TOP 5 
-                            accountID,
-                            accountNumber,
-                            account,
-                            dtmDate,
-                            amount
-                        FROM vw_GLSource_daily 
-                        ORDER BY dtmDate DESC
-                    """))
+                    result = connection.execute(_Q_SAMPLE)
                     
                     print("\n📋 Primeros 5 registros (más recientes):")
-                    print("-" * 80)
-                    for row in result:
-                        print(f"  ID: {row[0]} | Cuenta: {row[1]} | {row[2][:30]:<30} | Fecha: {row[3]} | Monto: ${row[4]:,.2f}")
-                    print("-" * 80)
+                    print(_RULE)
+                    print("\n".join(
+                        f"  ID: {row[0]} | Cuenta: {row[1]} | {row[2][:30]:<30} | Fecha: {row[3]} | Monto: ${row[4]:,.2f}"
+                        for row in result
+                    ))
+                    print(_RULE)
             else:
-                print("⚠️  La vista vw_GLSource_daily NO existe")
+                print(f"⚠️  La vista {_VIEW_NAME} NO existe")
                 print("   Ejecuta el script create_view.sql para crearla")
             
-            print("\n" + "=" * 80)
+            print("\n" + _BAR)
             print("✅ PRUEBA DE CONEXIÓN COMPLETADA EXITOSAMENTE")
-            print("=" * 80)
+            print(_BAR)
             
     except Exception as e:
         print(f"\n❌ Error al conectar a la base de datos:")
@@ -114,8 +202,8 @@ def test_database_connection():
 
 
 if __name__ == '__main__':
-    print("=" * 80)
+    print(_BAR)
     print("🧪 PRUEBA DE CONEXIÓN A BASE DE DATOS SQL SERVER")
-    print("=" * 80)
-    test_database_connection()
+    print(_BAR)
+    test_database_connection(verbose=True)
 